@@ -4,38 +4,43 @@ to get a list of products and then save them and
 their variants to a json file.
 '''
 
-from scraper.fetch_page import get_playwright_html
+from scraper.fetch_page import get_search_html, close_browser, close_contexts, MAX_PRODUCT_PAGES
 from scraper.detect import ProductCardDetector
-from scraper.variant_collector import get_variants, extract_data
+from scraper.variant_collector import get_variants, extract_data, FetchError
+from scraper.parse import close_parse_pool
 
 from bs4 import BeautifulSoup
 from typing import Optional, Dict, List, Union
-import json
-import glob
+import orjson
+import asyncio
 from collections import Counter
+from itertools import chain
 
-def get_vars(
+async def get_vars(
     product_page : str
 ) -> List[Dict[str, Optional[str]]]:
     '''
     Gets variants for the specified product page.
+    Raises FetchError if the page could not be loaded.
     '''
-    variants = get_variants(
+    variants = await get_variants(
         product_page,
         extract_data
     )
 
     return variants if variants else []
 
-def get_product_variants(
+async def get_product_variants(
         page_url, ret=3
         ) -> List[Dict[str, Optional[str]]]:
     try:
         """
         Wraps Retry logic around the get_vars function.
+        Only failed page loads are retried, a page that loaded
+        but has no variants will look the same next time.
         Args:
             page_url: The URL of the product page to extract variants from.
-            ret: Number of retries in case of failure.
+            ret: Number of attempts in case of a failed page load.
         Returns:
             A list of variants, where each variant is a dictionary
             with keys as variant attributes and values as their respective values.
@@ -43,11 +48,13 @@ def get_product_variants(
         variants : List[Dict[str, str | None]] = []
         # Retry logic
         for i in range(ret):
-            variants = get_vars(page_url)
-            if variants:
+            try:
+                variants = await get_vars(page_url)
                 break
-            print(f'retrying variant extraction for {page_url}...')
-            print()
+            except FetchError as e:
+                print(e)
+                print(f'retrying variant extraction for {page_url}...')
+                print()
         
         if not variants:
             print(f'could not get any variants for {page_url}')
@@ -59,27 +66,38 @@ def get_product_variants(
         print(f"(main) Error getting variants: {e}")
         return []
 
-def attach_variants(
+async def attach_variants(
         final_products : List[
-        Dict[str, Union[bool, Optional[str], List[Dict[str, Optional[str]]]]]]
+        Dict[str, Union[bool, Optional[str], List[Dict[str, Optional[str]]]]]],
+        concurrency : int = MAX_PRODUCT_PAGES
         ):
     """
     Attaches variants to each product in the final list of products.
+    Product pages are scraped concurrently on one shared browser.
     Args:
         final_products : The final list of scraped products.
+        concurrency : Max number of product pages open at once.
     """
-    # Get variants
-    for product in final_products:
-        try:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def attach(
+            product : Dict[str, Union[bool, Optional[str], List[Dict[str, Optional[str]]]]]):
+        async with sem:
             if (link := product.get('link')):
-                variants: List[Dict[str, Optional[str]]] = get_product_variants(str(link))
+                product['variants'] = await get_product_variants(str(link))
             else:
-                variants = []
-        except Exception as e:
-            print(f"Error getting variants for {product['link']}: {e}")
-            variants = []
+                product['variants'] = []
 
-        product['variants'] = variants
+    results = await asyncio.gather(
+        *(attach(product) for product in final_products),
+        return_exceptions=True
+    )
+
+    # A failed task leaves its product without variants
+    for product, result in zip(final_products, results):
+        if isinstance(result, Exception):
+            print(f"Error getting variants for {product['link']}: {result}")
+            product['variants'] = []
 
 def save(
         final_products_with_variants: List[
@@ -89,8 +107,8 @@ def save(
     
     print('saving data ...\n')
     try:
-        with open('outputs/final.json', 'w') as f:
-            json.dump(final_products_with_variants, f, indent=4)
+        with open('outputs/final.json', 'wb') as f:
+            f.write(orjson.dumps(final_products_with_variants, option=orjson.OPT_INDENT_2))
         
         print('file saved.\n')
     
@@ -99,9 +117,10 @@ def save(
         print(e)
 
 
-def run_scraper(
+async def run_scraper(
         pass_num: int,
-        url: str):
+        url: str
+        ) -> List[Dict[str, Union[bool, Optional[str], List[Dict[str, Optional[str]]]]]]:
     """
     Scraping engine. it scrapes products and saves them
     to a run*.json file.
@@ -109,20 +128,24 @@ def run_scraper(
         pass_num: The number of the current pass which will
         be used to save the run*.json file.
         url: The URL of the page to scrape.
+    Returns:
+        The scraped products, same as the saved file.
     """
-    html: str = get_playwright_html(url=url)
-    soup = BeautifulSoup(html, features="html.parser")
+    html: str = await get_search_html(url=url)
+    soup = BeautifulSoup(html, features="lxml")
 
     detector = ProductCardDetector(soup)
     products: List[
-        Dict[str, Union[bool, Optional[str], List[Dict[str, Optional[str]]]]]] = detector.get_all_product_cards()
+        Dict[str, Union[bool, Optional[str], List[Dict[str, Optional[str]]]]]] = await detector.get_all_product_cards()
 
     # Save products and their variants
-    with open(f"outputs/run{pass_num}.json", "w") as f:
-        json.dump(products, f, indent=4)
+    with open(f"outputs/run{pass_num}.json", "wb") as f:
+        f.write(orjson.dumps(products, option=orjson.OPT_INDENT_2))
 
     print(f"Found {len(products)} products.")
 
+    return products
+
 def generate_stats(
         all_runs_asins: List[List[str]],
         num_passes: int):
@@ -139,35 +162,31 @@ def generate_stats(
     """
     try:
 
-        # flat list of all asins
-        all_asins_flat = [asin for run in all_runs_asins for asin in run]
-
-        # count the asins
-        asins_counts = Counter(all_asins_flat)
+        # count the asins across all runs
+        asins_counts = Counter(chain.from_iterable(all_runs_asins))
 
         # unique asins
         unique_asins = len(asins_counts)
 
-        # avg asins
-        avg_asins = sum(len(run) for run in all_runs_asins) / num_passes
-
-        # max asins
-        max_asins = max(len(run) for run in all_runs_asins)
-
-        # min asins
-        min_asins = min(len(run) for run in all_runs_asins)
-
-        # count of asins seen once
-        asins_seen_once = sum(1 for count in asins_counts.values() if count == 1)
-
-        # count of asins seen everytime
-        asins_seen_everytime = sum(1 for count in asins_counts.values() if count == num_passes)
-
-        # list of asins seen once
-        seen_once_asins_list = [asin for asin, count in asins_counts.items() if count == 1]
-
-        # list of asins seen everytime
-        seen_everytime_asins_list = [asin for asin, count in asins_counts.items() if count == num_passes]
+        # avg, max and min asins from the run lengths
+        run_lengths = [len(run) for run in all_runs_asins]
+        avg_asins = sum(run_lengths) / num_passes
+        max_asins = max(run_lengths)
+        min_asins = min(run_lengths)
+
+        # asins seen once and asins seen everytime, in one pass
+        asins_seen_once = 0
+        asins_seen_everytime = 0
+        seen_once_asins_list = []
+        seen_everytime_asins_list = []
+
+        for asin, count in asins_counts.items():
+            if count == 1:
+                asins_seen_once += 1
+                seen_once_asins_list.append(asin)
+            if count == num_passes:
+                asins_seen_everytime += 1
+                seen_everytime_asins_list.append(asin)
 
         # Generate file
         stats_dict = {
@@ -194,22 +213,27 @@ def generate_stats(
             "seen_everytime_asins_list": []
         }
     # Save the stats to a json file
-    with open("outputs/stats.json", "w") as f:
-        json.dump(stats_dict, f, indent=4)
+    with open("outputs/stats.json", "wb") as f:
+        f.write(orjson.dumps(stats_dict, option=orjson.OPT_INDENT_2))
     print(f"Stats generated and saved to outputs/stats.json")
 
     return stats_dict["seen_everytime_asins_list"]
 
-def main():
-    print("Starting Amazon Scraper...\n")
-
-    url = "https://www.amazon.com/Headphones-Headsets/s?k=Headphones+and+Headsets"
-    num_passes = 2
-
-    for i in range(1, num_passes + 1):
-        print(f"Running pass {i} of {num_passes}...")
-        print()
-        run_scraper(i, url)
+async def scrape(
+        url: str,
+        num_passes: int):
+    """
+    Runs all passes concurrently, then attaches variants
+    to the stable products and saves them.
+    Args:
+        url: The URL of the page to scrape.
+        num_passes: number of runs.
+    """
+    print(f"Running {num_passes} passes...")
+    print()
+    all_runs = await asyncio.gather(
+        *(run_scraper(i, url) for i in range(1, num_passes + 1))
+    )
 
     print(f'{num_passes} passes completed. gathering stats...\n')
     
@@ -219,17 +243,23 @@ def main():
     all_unique_products : List[
         Dict[str, Union[bool, Optional[str], List[Dict[str, Optional[str]]]]]] = []
 
-    for file_path in glob.glob("outputs/run*.json"):
-        with open(file_path, 'r') as f:
-            products = json.load(f)
+    # The passes returned their products, so the run*.json
+    # files dont need to be read back. dedupe and collect
+    # each run's asins in the same pass.
+    for products in all_runs:
+        asins: List[str] = []
 
-            for p in products:
-                if p.get('asin') and p['asin'] not in seen_asins:
-                    seen_asins.add(p['asin'])
-                    all_unique_products.append(p)
+        for p in products:
+            asin = p.get('asin')
+            if not asin:
+                continue
 
-            asins = [p['asin'] for p in products if p.get('asin')]
-            all_runs_asins.append(asins)
+            if asin not in seen_asins:
+                seen_asins.add(asin)
+                all_unique_products.append(p)
+            asins.append(asin)
+
+        all_runs_asins.append(asins)
 
 
     # Get a final list of products
@@ -245,12 +275,26 @@ def main():
 
         # attach variants Only to stable products (seen in each pass)
         if final_products_list:
-            attach_variants(final_products=final_products_list)
+            await attach_variants(final_products=final_products_list)
             print('variants attached')
             save(final_products_with_variants=final_products_list)
     
     else:
         print('seen everytime asins was empty.')
 
+async def main():
+    print("Starting Amazon Scraper...\n")
+
+    url = "https://www.amazon.com/Headphones-Headsets/s?k=Headphones+and+Headsets"
+    num_passes = 2
+
+    try:
+        await scrape(url, num_passes)
+    finally:
+        # The workers go first, see _get_parse_pool
+        close_parse_pool()
+        await close_contexts()
+        await close_browser()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
@@ -4,9 +4,11 @@ inside the target page.
 '''
 
 from urllib.parse import urlparse, urlunparse
+import re
+import asyncio
 from collections import Counter
-from bs4 import BeautifulSoup, Tag
-from typing import Optional, Tuple, Dict, List, Union, cast
+from bs4 import BeautifulSoup, NavigableString, Tag
+from typing import Optional, Tuple, Dict, List, FrozenSet, Union, cast
 
 import scraper.parse as parse
 
@@ -25,14 +27,35 @@ class ProductCardDetector:
     this way we arent relying on concrete css
     or html.
     '''
+    # Class name fragments that mark a grid/product container
+    GRID_KEYWORDS = ('grid', 'results', 'items', 'products', 'card')
+
+    # The caches are read in the per-div hot loop,
+    # slots make those attribute reads cheaper.
+    __slots__ = (
+        'soup',
+        'grid_containers',
+        '_grid_re',
+        '_title_re',
+        '_divs',
+        '_struct_cache',
+        '_class_cache'
+    )
+
     def __init__(self, soup):
         self.soup : BeautifulSoup = soup
-        self.grid_containers = self.soup.find_all(
-            class_=lambda x: bool(x) and any(
-                c in str(x).lower() 
-                for c in ['grid', 'results', 'items', 'products', 'card']
-            )
+        # Compiled once, bs4 matches them against each class value
+        self._grid_re = re.compile('|'.join(self.GRID_KEYWORDS), re.I)
+        self._title_re = re.compile(r'title|name', re.I)
+        self.grid_containers : List[Tag] = self._outermost(
+            self.soup.find_all(class_=self._grid_re)
         )
+        # Filled by _candidate_divs and the signature getters so
+        # the signature search and the card search share one walk.
+        # Keyed by id(tag), the tags live as long as self.soup.
+        self._divs : Optional[List[Tag]] = None
+        self._struct_cache : Dict[int, Tuple[str, ...]] = {}
+        self._class_cache : Dict[int, FrozenSet[str]] = {}
 
     def get_structure_signature(self, tag : Tag) -> Tuple[str, ...]:
         '''
@@ -43,37 +66,86 @@ class ProductCardDetector:
         Returns:
         A tuple of strings representing the structures signature
         '''
-        # Holds the names of direct child elements of the tag
-        tags = []
-        for child in tag.find_all(recursive=False):
-            if isinstance(child, Tag) and child.name:
-                tags.append(child.name)
+        key = id(tag)
+        if key in self._struct_cache:
+            return self._struct_cache[key]
+
+        # Names of the direct child elements of the tag.
+        # Iterating .children skips the SoupStrainer that
+        # find_all(recursive=False) builds on every call.
+        signature = tuple(
+            child.name for child in tag.children
+            if isinstance(child, Tag)
+        )
         
-        return tuple(tags)
+        self._struct_cache[key] = signature
+        return signature
 
-    def get_class_signature(self, tag : Tag) -> Tuple[str, ...]:
+    def get_class_signature(self, tag : Tag) -> FrozenSet[str]:
         '''
         Gets the class signature of the given tag.
         Args:
             tag : bs4 Tag object
         Returns:
-            A tuple of class names sorted alphabetically.
+            A frozenset of class names, so the order of the
+            classes in the html doesnt matter.
         '''
+        key = id(tag)
+        if key in self._class_cache:
+            return self._class_cache[key]
+
         class_attr : Union[str, List[str], None] = tag.get("class")
         
         # The case where it may be None
         if class_attr is None:
-            return tuple()
+            signature : FrozenSet[str] = frozenset()
         
         # The case where it may be str
-        if isinstance(class_attr, str):
-            return tuple(class_attr,)
+        elif isinstance(class_attr, str):
+            signature = frozenset((class_attr,))
         
         # if its neither, then its a List[str]
-        classes = cast(List[str], class_attr)
+        else:
+            classes = cast(List[str], class_attr)
+            signature = frozenset(classes)
         
-        return tuple(sorted(classes))
+        self._class_cache[key] = signature
+        return signature
     
+    @staticmethod
+    def _outermost(containers) -> List[Tag]:
+        '''
+        Grid containers are often nested inside each other.
+        This drops every container that lives inside another
+        one, so no subtree is walked twice later on.
+        Args:
+            containers: The matched grid containers.
+        Returns:
+            The containers that have no matched ancestor.
+        '''
+        container_ids = {id(c) for c in containers}
+
+        return [
+            c for c in containers
+            if isinstance(c, Tag)
+            and not any(id(parent) in container_ids for parent in c.parents)
+        ]
+
+    def _candidate_divs(self) -> List[Tag]:
+        '''
+        Collects every div inside the grid containers once.
+        Returns:
+            A list of div tags in document order.
+        '''
+        if self._divs is None:
+            self._divs = [
+                div for container in self.grid_containers
+                for div in container.find_all("div", recursive=True)
+                if isinstance(div, Tag)
+            ]
+
+        return self._divs
+
     def _visible(self, container : Tag) -> bool:
         ''' Gets a container and checks its visibility.
         Args:
@@ -81,58 +153,55 @@ class ProductCardDetector:
         Returns:
             - True if the container is visible, False otherwise.
         '''
-        style_attr = container.get('style', '')
-        style = str(style_attr) if style_attr is not None else ''
-        normalized_style = style.replace(' ', '').lower()
+        # Most tags have no style, skip the normalization for them
+        style_attr = container.get('style')
+        if style_attr:
+            normalized_style = str(style_attr).replace(' ', '').lower()
+        else:
+            normalized_style = ''
 
-        aria_hidden = str(container.get('aria-hidden', '')).lower()
+        aria_hidden = container.get('aria-hidden')
 
-        if 'display:none' in normalized_style:
-            return False
-        if aria_hidden == "true":
-            return False
-         
-        return True
+        return not (
+            'display:none' in normalized_style
+            or (aria_hidden is not None and str(aria_hidden).lower() == "true")
+        )
 
     def find_mostcommon_signiture(
             self
-            ) -> Tuple[List[Tuple[str, ...]], List[Tuple[str, ...]]]:
+            ) -> Tuple[FrozenSet[Tuple[str, ...]], FrozenSet[FrozenSet[str]]]:
         ''' 
         Finds the top 3 most common structure and class signatures
         in the grid containers using the soup object passed to the
         class.
         
         Returns:
-            - most_common_structures: List of tuples containing the most common structure signatures
-            - most_common_classes: List of tuples containing the most common class signatures
+            - most_common_structures: Frozenset of the most common structure signatures
+            - most_common_classes: Frozenset of the most common class signatures
         '''
         
         structure_signatures : list[tuple] = []
-        class_signatures : list[tuple] = []
-
-        for container in self.grid_containers:
-            if isinstance(container, Tag):
-                for div in container.find_all("div"):
-                    if not isinstance(div, Tag):
-                        continue
+        class_signatures : list[frozenset] = []
 
-                    structure_signature = self.get_structure_signature(div)
-                    class_signature = self.get_class_signature(div)
-                    
-                    if len(structure_signature) >= 3 and structure_signature not in [('label',), ('i', 'span')]:
-                        structure_signatures.append(structure_signature)
-                        class_signatures.append(class_signature)
+        for div in self._candidate_divs():
+            structure_signature = self.get_structure_signature(div)
+            class_signature = self.get_class_signature(div)
+            
+            if len(structure_signature) >= 3 and structure_signature not in [('label',), ('i', 'span')]:
+                structure_signatures.append(structure_signature)
+                class_signatures.append(class_signature)
 
 
-        most_common_structures = [s for s,_ in Counter(structure_signatures).most_common(3)]
-        most_common_classes = [c for c,_ in Counter(class_signatures).most_common(3)]
+        # Sets, because every candidate div is checked against them
+        most_common_structures = frozenset(s for s,_ in Counter(structure_signatures).most_common(3))
+        most_common_classes = frozenset(c for c,_ in Counter(class_signatures).most_common(3))
 
         return most_common_structures, most_common_classes
 
     def is_product_card(
             self, tag : Tag,
-            most_common_structures,
-            most_common_classes
+            most_common_structures : FrozenSet[Tuple[str, ...]],
+            most_common_classes : FrozenSet[FrozenSet[str]]
             ) -> bool:
         '''Gets the structure and class signatures of the tag
         and checks if they match the most common signatures.
@@ -154,61 +223,121 @@ class ProductCardDetector:
         tag_match : bool = tag_structure in most_common_structures
         class_match : bool = tag_class in most_common_classes
 
-        has_price = bool(tag.find(string=lambda text: '$' in str(text)))
-        has_image = bool(tag.find('img'))
-        has_title = bool(tag.find(['h2', 'h3', 'h4', 'span', 'div'], 
-                           class_=lambda x: bool(x) and any(c in str(x).lower() for c in ['title', 'name'])))
+        # Most divs fail here, so they never pay for the text scan
+        if not (tag_match or class_match):
+            return False
+
+        # One walk over the subtree for all three checks
+        # instead of a separate find() per check.
+        has_price = has_image = has_title = False
+        for el in tag.descendants:
+            if isinstance(el, NavigableString):
+                if not has_price and '$' in el:
+                    has_price = True
+            elif isinstance(el, Tag):
+                if el.name == 'img':
+                    has_image = True
+                elif not has_title and el.name in ('h2', 'h3', 'h4', 'span', 'div'):
+                    classes = el.get('class')
+                    if classes:
+                        if isinstance(classes, str):
+                            classes = [classes]
+                        has_title = any(self._title_re.search(c) for c in classes)
+            
+            # Two out of three is enough, the rest wont change the result
+            if (has_price + has_image + has_title) >= 2:
+                break
         
         is_product = (has_price + has_image + has_title) >= 2
 
-        return (tag_match or class_match) and is_product
+        return is_product
     
-    def get_all_product_cards(self) -> List[Dict[str, Union[bool, Optional[str], List[Dict[str, Optional[str]]]] ]]:
+    async def _apply_fallbacks(
+            self,
+            cards : List[Dict[str, Union[bool, Optional[str], List[Dict[str, Optional[str]]]]]],
+            sem : asyncio.Semaphore
+            ) -> List[Dict[str, Union[bool, Optional[str], List[Dict[str, Optional[str]]]]]]:
+        '''
+        Runs the extract data fallback for every card that
+        needs it. the product pages are loaded concurrently.
+        Args:
+            cards: Parsed product cards, in page order.
+            sem: Bounds how many product pages are open at once.
+        Returns:
+            The cards in the same order, without the ones
+            whose fallback failed.
+        '''
+        async def fallback(
+                data : Dict[str, Union[bool, Optional[str], List[Dict[str, Optional[str]]]]]):
+            if not data['_needs_fallback']:
+                return data
+            async with sem:
+                return await parse.extract_data_fallback(data, str(data.get('link')))
+
+        results = await asyncio.gather(
+            *(fallback(data) for data in cards),
+            return_exceptions=True
+        )
+
+        filled = []
+        for data, result in zip(cards, results):
+            if isinstance(result, BaseException):
+                print(f'fallback Failed for {data["link"]} error:\n{result}')
+                continue
+            filled.append(result)
+
+        return filled
+
+    async def get_all_product_cards(
+            self,
+            max_products : int = 10,
+            fallback_concurrency : int = 8
+            ) -> List[Dict[str, Union[bool, Optional[str], List[Dict[str, Optional[str]]]] ]]:
         '''
         This method acts as a facade for the users of this class.
         it hides the complexity of finding the product cards.
         It guarantees that the products found, dont have missing
         data by applying the extract data and extract data fallback
         logic form parse.
+        Args:
+            max_products: Stop as soon as this many products are
+            found, so no more divs are parsed or fallbacks run.
+            fallback_concurrency: Max number of product pages the
+            fallback loads at once.
         Returns:
             A list of dictionaries containing the product cards.
         '''
 
         product_cards : List[Dict[str, Union[bool, Optional[str], List[Dict[str, Optional[str]]]] ]] = []
+        # Parsed cards waiting for their fallbacks
+        pending : List[Dict[str, Union[bool, Optional[str], List[Dict[str, Optional[str]]]] ]] = []
         seen_asins = set()
+        sem = asyncio.Semaphore(fallback_concurrency)
         
         most_common_structures, most_common_classes = self.find_mostcommon_signiture()
 
         if not most_common_structures or not most_common_classes:
             return product_cards
 
-        for container in self.grid_containers:
-            if isinstance(container, Tag):
-                container_divs = container.find_all("div", recursive=True)
-                for div in container_divs:
-                    if not isinstance(div, Tag):
-                        continue
-
-                    if self.is_product_card(div, most_common_structures, most_common_classes):
-                        data : Dict[str, Union[bool, Optional[str], List[Dict[str, Optional[str]]]]] = parse.extract_data(div)
-                        
-                        if data: #and data.get('link'):
-                            if data['asin'] not in seen_asins:
-                                seen_asins.add(data['asin'])
-
-                                if data['_needs_fallback']:
-                                    try:
-                                        data : Dict[str, Union[bool, Optional[str], List[Dict[str, Optional[str]]]]] = parse.extract_data_fallback(
-                                            data, str(data.get('link')))
-                                    except Exception as e:
-                                        print(f'fallback Failed for {data["link"]} error:\n{e}')
-                                        continue
-                        
-                                product_cards.append(data)
-
-                                # Test with 10
-                                if len(product_cards) >= 10:
-                                    print('length 10 reached')
-                                    return product_cards
+        for div in self._candidate_divs():
+            if self.is_product_card(div, most_common_structures, most_common_classes):
+                data : Dict[str, Union[bool, Optional[str], List[Dict[str, Optional[str]]]]] = parse.extract_data(div)
+                
+                if data: #and data.get('link'):
+                    if data['asin'] not in seen_asins:
+                        seen_asins.add(data['asin'])
+                        pending.append(data)
+
+                        # Enough cards to reach the limit, fill them
+                        # all at once. failed ones are replaced by
+                        # the next cards on the page.
+                        if len(product_cards) + len(pending) >= max_products:
+                            product_cards += await self._apply_fallbacks(pending, sem)
+                            pending = []
+
+                            if len(product_cards) >= max_products:
+                                print(f'length {max_products} reached')
+                                return product_cards
         
-        return product_cards
\ No newline at end of file
+        product_cards += await self._apply_fallbacks(pending, sem)
+        return product_cards
@@ -1,15 +1,18 @@
 
-from playwright.sync_api import sync_playwright
+from playwright.async_api import async_playwright, Playwright, Browser, BrowserContext, Route
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 
-from playwright.sync_api import Page
-import time
+import asyncio
 import random
-from typing import Tuple, Optional
+import httpx
+import lxml.html
+from lxml import etree
+from typing import Tuple, Optional, List
 
 # To avoid getting blocked or detected as a bot, we need to
 # send GET requests using different user_agents to mimic real
 # human behavior.
-USER_AGENTS = [
+USER_AGENTS = (
       # Windows (Chrome, Edge, Firefox)
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Edge/120.0.0.0 Safari/537.36",
@@ -37,71 +40,408 @@ USER_AGENTS = [
     
     # Windows Phone (Edge)
     "Mozilla/5.0 (Windows Phone 10.0; Android 6.0.1; Microsoft; Lumia 950) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36 Edge/40.15254.603"
+)
+
+# Chromium flags that hide the automation banner and
+# keep the browser light inside containers.
+LAUNCH_ARGS = [
+    '--disable-blink-features=AutomationControlled',
+    '--disable-infobars',
+    '--window-position=0,0',
+    '--ignore-certificate-errors',
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-accelerated-2d-canvas',
+    '--no-first-run',
+    '--no-zygote',
+    '--disable-gpu',
+    '--disable-extensions',
+    '--disable-default-apps'
 ]
 
+# Clears Playwright's automation flags. injected once per
+# context, it then runs in every page of the context.
+STEALTH_JS = """
+    delete navigator.__proto__.webdriver;
+    Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+    window.navigator.chrome = {runtime: {}, etc: 'etc'};
+"""
+
+# Max product pages open at once, shared by the context
+# pool and the caller's concurrency so the two agree.
+MAX_PRODUCT_PAGES = 10
+
+# Amazon marks every search result card with this attribute
+RESULT_SELECTOR = '[data-component-type="s-search-result"]'
+_RESULT_XPATH = etree.XPath('//*[@data-component-type="s-search-result"]')
+
+# Resources the scraper never reads. image urls come from
+# the html attributes, so the image bytes aren't needed.
+# stylesheets are kept, lazy loading depends on the layout.
+BLOCKED_RESOURCE_TYPES = frozenset({"image", "media", "font"})
+# Ad and analytics hosts, nothing on them is scraped
+BLOCKED_HOSTS = ("doubleclick", "google-analytics", "googletagmanager", "adsystem")
+
+
+async def block_resources(route: Route):
+    '''
+    Route handler that aborts requests for the resource
+    types in BLOCKED_RESOURCE_TYPES or to the BLOCKED_HOSTS
+    and lets the rest through.
+    usage: await context.route("**/*", block_resources)
+    '''
+    request = route.request
+    if (request.resource_type in BLOCKED_RESOURCE_TYPES
+            or any(host in request.url for host in BLOCKED_HOSTS)):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def launch_browser(p: Playwright, headless: bool = True) -> Browser:
+    '''
+    Launches one chromium browser that can be shared
+    between concurrent tasks. each task should open its
+    own context and page on it.
+    Args:
+        p: The running async playwright instance.
+        headless: Run browser in headless mode.
+    Returns:
+        The launched browser. closing it is up to the caller.
+    '''
+    return await p.chromium.launch(
+        headless=headless,
+        args=LAUNCH_ARGS,
+        slow_mo=random.randint(0, 100)  # Humanize the speed
+    )
+
+class BrowserPool:
+    '''
+    Launching chromium costs seconds while a new context
+    costs milliseconds. so the pool keeps one playwright
+    instance and one browser alive, and every page load
+    only opens a context on it.
+    The browser is launched on first use and closed with
+    close(), it can also be used as an async context manager.
+    '''
+    def __init__(self, headless: bool = True):
+        self.headless = headless
+        self._playwright : Optional[Playwright] = None
+        self._browser : Optional[Browser] = None
+        self._lock = asyncio.Lock()
+
+    async def get(self) -> Browser:
+        '''
+        Returns the browser, launching it on first use
+        (or again if it has crashed).
+        '''
+        # Concurrent first calls must not launch two browsers
+        async with self._lock:
+            if self._browser is None or not self._browser.is_connected():
+                if self._playwright is None:
+                    self._playwright = await async_playwright().start()
+                self._browser = await launch_browser(self._playwright, self.headless)
+
+        return self._browser
+
+    async def close(self):
+        '''
+        Closes the browser and stops playwright.
+        '''
+        try:
+            if self._browser:
+                await self._browser.close()
+        except Exception as e:
+            print(f"Error closing browser: {e}")
+        finally:
+            self._browser = None
+
+        try:
+            if self._playwright:
+                await self._playwright.stop()
+        except Exception as e:
+            print(f"Error stopping playwright: {e}")
+        finally:
+            self._playwright = None
+
+    async def __aenter__(self) -> 'BrowserPool':
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+# The pool shared by the whole process
+_pool = BrowserPool()
+
+
+async def get_browser(headless: bool = True) -> Browser:
+    '''
+    Returns the shared browser of the process wide pool.
+    Args:
+        headless: Run browser in headless mode. only used
+        when the browser is launched.
+    Returns:
+        The shared browser.
+    '''
+    if _pool._browser is None:
+        _pool.headless = headless
+    return await _pool.get()
+
+
+async def close_browser():
+    '''
+    Closes the shared browser and stops playwright.
+    Should be called once when the program is done.
+    '''
+    await _pool.close()
+
+
+class ContextPool:
+    '''
+    Keeps up to `size` browser contexts for the product pages
+    and hands them out one at a time. a context is reused for
+    many urls, so its setup (routes, init script) is paid once
+    and its cookies stay warm like a returning visitor's.
+    Also bounds how many product pages are open at once.
+    '''
+    def __init__(self, size : int = MAX_PRODUCT_PAGES, headless : bool = True):
+        self.size = size
+        self.headless = headless
+        self._idle : List[BrowserContext] = []
+        # One slot per context that is handed out
+        self._slots = asyncio.Semaphore(size)
+
+    async def _new_context(self) -> BrowserContext:
+        browser = await get_browser(self.headless)
+        context = await browser.new_context(
+            user_agent=random.choice(USER_AGENTS),
+            viewport={"width": 1280, "height": 800},
+            locale="en-US",
+            bypass_csp=True  
+        )
+        # Option values come from the html (img alt, text),
+        # the image bytes and trackers are never needed.
+        await context.route("**/*", block_resources)
+        await context.add_init_script(STEALTH_JS)
+        return context
+
+    async def acquire(self) -> BrowserContext:
+        '''
+        Waits for a free slot, then returns an idle context
+        or creates a new one.
+        '''
+        await self._slots.acquire()
+        if self._idle:
+            return self._idle.pop()
+
+        try:
+            return await self._new_context()
+        except BaseException:
+            self._slots.release()
+            raise
 
-def get_playwright_html(url: str, scroll_steps: int = 15, headless: bool = True) -> str:
+    async def release(self, context : BrowserContext, broken : bool = False):
+        '''
+        Gives a context back to the pool. a broken context
+        (e.g. its page load failed) is closed instead, the
+        next acquire creates a fresh one.
+        '''
+        try:
+            if broken:
+                await context.close()
+            else:
+                self._idle.append(context)
+        except Exception as e:
+            print(f"Error closing context: {e}")
+        finally:
+            self._slots.release()
+
+    async def close(self):
+        '''
+        Closes the idle contexts. should be called once all
+        the product pages are done, before the browser closes.
+        '''
+        while self._idle:
+            context = self._idle.pop()
+            try:
+                await context.close()
+            except Exception as e:
+                print(f"Error closing context: {e}")
+
+
+# The pool shared by all the product pages
+_contexts = ContextPool()
+
+
+async def acquire_context(headless: bool = True) -> BrowserContext:
+    '''
+    Borrows a context of the shared pool, see ContextPool.acquire.
+    Args:
+        headless: Run browser in headless mode. only used
+        when the browser is launched.
+    Returns:
+        A context on the shared browser.
+    '''
+    _contexts.headless = headless
+    return await _contexts.acquire()
+
+
+async def release_context(context: BrowserContext, broken: bool = False):
+    '''
+    Gives a context back to the shared pool, see ContextPool.release.
+    '''
+    await _contexts.release(context, broken=broken)
+
+
+async def close_contexts():
+    '''
+    Closes the pooled product page contexts. should be
+    called before close_browser.
+    '''
+    await _contexts.close()
+
+
+async def get_playwright_html(
+        url: str,
+        scroll_steps: int = 15,
+        min_results: int = 30,
+        headless: bool = True) -> str:
+    '''
+    Opens the url in a fresh context of the shared browser,
+    scrolls to trigger lazy loading and returns the html.
+    Args:
+        url: The page to load.
+        scroll_steps: Max number of times to scroll down.
+        min_results: Stop scrolling once the page has this many
+        search result cards. 0 stops after the first scroll,
+        e.g. for product pages.
+        headless: Run browser in headless mode, see get_browser.
+    Returns:
+        The page html or an empty string on failure.
+    '''
+    context = None
     try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(
-                headless=headless,
-                args=[
-                    '--disable-blink-features=AutomationControlled',
-                    '--disable-infobars',
-                    '--window-position=0,0',
-                    '--ignore-certificate-errors',
-                    '--no-sandbox',
-                    '--disable-setuid-sandbox',
-                    '--disable-dev-shm-usage',
-                    '--disable-accelerated-2d-canvas',
-                    '--no-first-run',
-                    '--no-zygote',
-                    '--disable-gpu',
-                    '--disable-extensions',
-                    '--disable-default-apps'
-                ]
-            )
-            context = browser.new_context(
-                user_agent=random.choice(USER_AGENTS),
-                viewport={"width": 1280, "height": 800},
-                locale="en-US",
-                timezone_id="America/New_York",
-                color_scheme="light",
-                bypass_csp=True,
-                device_scale_factor=random.uniform(1, 1.5),
-                geolocation={"longitude": -74.0060, "latitude": 40.7128}   
+        browser = await get_browser(headless)
+        context = await browser.new_context(
+            user_agent=random.choice(USER_AGENTS),
+            viewport={"width": 1280, "height": 800},
+            locale="en-US",
+            timezone_id="America/New_York",
+            color_scheme="light",
+            bypass_csp=True,
+            device_scale_factor=random.uniform(1, 1.5),
+            geolocation={"longitude": -74.0060, "latitude": 40.7128}   
+        )
+        await context.route("**/*", block_resources)
+        await context.add_init_script(STEALTH_JS)
+        page = await context.new_page()
+
+        # Randomize initial interactions
+        if random.random() > 0.5:
+            await page.mouse.move(
+                random.randint(0, 500),
+                random.randint(0, 500)
             )
-            page = context.new_page()
 
-            # Randomize initial interactions
-            if random.random() > 0.5:
-                page.mouse.move(
-                    random.randint(0, 500),
-                    random.randint(0, 500)
+        print(f"Navigating to {url}")
+        # The results are read from the DOM, there is no
+        # need to wait for the load event of every resource.
+        await page.goto(url, timeout=60000, wait_until='domcontentloaded')  # 60s timeout
+
+        # Scroll to load lazy-loaded products, but stop as
+        # soon as enough of them are on the page.
+        for i in range(scroll_steps):
+            await page.evaluate("window.scrollBy(0, 2000)")
+            try:
+                await page.wait_for_function(
+                    "([selector, n]) => document.querySelectorAll(selector).length >= n",
+                    arg=[RESULT_SELECTOR, min_results],
+                    timeout=1500
                 )
-            
-            # Clear Playwright's automation flags
-            page.add_init_script("""
-                delete navigator.__proto__.webdriver;
-                Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
-                window.navigator.chrome = {runtime: {}, etc: 'etc'};
-            """)
-
-            print(f"Navigating to {url}")
-            page.goto(url, timeout=60000)  # 60s timeout
-
-            # Simulate slow scroll to load lazy-loaded products
-            for i in range(scroll_steps):
-                #page.mouse.wheel(0, 1000)
-                page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-                time.sleep(random.uniform(0.8, 1.5))
-
-            # Optional: wait for more products (e.g., 30+ cards)
-            page.wait_for_timeout(3000)  # let JS finish
-
-            html = page.content()
-            browser.close()
-            return html
+                break
+            except PlaywrightTimeoutError:
+                pass
+
+        # Wait for the grid instead of a fixed sleep. product
+        # pages have no grid, they skip this.
+        if min_results > 0:
+            try:
+                await page.wait_for_selector(RESULT_SELECTOR, timeout=5000)
+            except PlaywrightTimeoutError:
+                print(f'No search results rendered on {url}')
+
+        html = await page.content()
+        return html
     except Exception as e:
         print(f'Failed to get page. exception:\n{e}')
-        return ""
\ No newline at end of file
+        return ""
+    finally:
+        # The browser is shared, only our context is closed
+        try:
+            if context:
+                await context.close()
+        except Exception as e:
+            print(f"Error closing context: {e}")
+
+
+async def try_fetch_static(url: str, min_results: int = 20) -> Optional[str]:
+    '''
+    Many search pages already have their result cards in
+    the server side html. this fetches the page with a
+    plain http request, which is much cheaper than a browser.
+    Args:
+        url: The page to load.
+        min_results: How many result cards the html needs to
+        be usable without a browser.
+    Returns:
+        The html, or None if the request failed or the page
+        had too few result cards (e.g. a captcha page).
+    '''
+    try:
+        async with httpx.AsyncClient(
+            http2=True,
+            headers={
+                "User-Agent": random.choice(USER_AGENTS),
+                "Accept-Language": "en-US,en;q=0.9"
+            },
+            follow_redirects=True,
+            timeout=30
+        ) as client:
+            response = await client.get(url)
+            response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f'Static fetch failed for {url}: {e}')
+        return None
+
+    # lxml reads the raw bytes itself, the body is only
+    # decoded to str when the page turns out to be usable.
+    try:
+        parser = lxml.html.HTMLParser(encoding=response.encoding)
+        results = _RESULT_XPATH(lxml.html.fromstring(response.content, parser=parser))
+    except (etree.ParserError, ValueError, LookupError):
+        return None
+
+    if len(results) < min_results:
+        return None
+
+    return response.text
+
+
+async def get_search_html(url: str) -> str:
+    '''
+    Gets the html of a search results page. tries a plain
+    http request first and only loads the page in the
+    browser when the static html doesnt have the results.
+    Args:
+        url: The search page to load.
+    Returns:
+        The page html or an empty string on failure.
+    '''
+    html = await try_fetch_static(url)
+    if html:
+        print(f"Got {url} without a browser")
+        return html
+
+    return await get_playwright_html(url)
@@ -3,12 +3,67 @@ In this file, we parse the target page to get
 a list of products.
 '''
 import re
-from bs4 import Tag, BeautifulSoup
-from typing import Dict, Optional, Union, List
-import time, random
+from bs4 import Tag, NavigableString
+from lxml import etree
+import lxml.html
+from typing import Dict, Optional, Union, List, Tuple
+import asyncio, random, os
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 
 import scraper.fetch_page as fp
 
+# span/div/td elements whose text contains a '$', in document
+# order. libxml2 evaluates the predicate, not a python callback.
+_PRICE_CONTAINERS_XPATH = etree.XPath(
+    "//*[self::span or self::div or self::td][contains(string(.), '$')]"
+)
+# Comments are dropped while parsing, like bs4's get_text skips them
+_LXML_PARSER = lxml.html.HTMLParser(remove_comments=True)
+
+# Product page selectors, tried in order. #productTitle, #title,
+# h1.a-size-large and #landingImage, #imgBlkFront, #main-image
+_TITLE_XPATHS = [
+    etree.XPath('//*[@id="productTitle"]'),
+    etree.XPath('//*[@id="title"]'),
+    etree.XPath('//h1[contains(concat(" ", normalize-space(@class), " "), " a-size-large ")]')
+]
+_IMAGE_XPATHS = [
+    etree.XPath('//*[@id="landingImage"]'),
+    etree.XPath('//*[@id="imgBlkFront"]'),
+    etree.XPath('//*[@id="main-image"]')
+]
+
+# Parsing product pages is cpu bound, the pool runs it on
+# all the cores while the event loop keeps fetching.
+# Created on first use, see close_parse_pool.
+_parse_pool : Optional[ProcessPoolExecutor] = None
+
+# Compiled once at import, they run for every product tag
+_PRICE_RE = re.compile(r"\$(\d+[,.]?\d*)")
+# /dp/ASIN, /gp/product/ASIN, /product/ASIN or ?ASIN=... in one scan
+_ASIN_RE = re.compile(r'(?:/dp/|/gp/product/|/product/|ASIN=)([A-Z0-9]{10})')
+# Just ASIN, only tried when none of the above matched
+_BARE_ASIN_RE = re.compile(r'([A-Z0-9]{10})')
+
+def _price_in_text(text : str) -> Optional[str]:
+    '''
+    Extracts the first pattern like $10, $3.50, or $1,000
+    from the given text.
+    Args:
+    text : the text to search
+    Returns:
+    string or none
+    '''
+    # Most tags have no '$' at all, skip the regex for them
+    if '$' not in text:
+        return None
+
+    match = _PRICE_RE.search(text)
+    
+    return match.group(0) if match else None
+
 def find_price(tag : Tag) -> Optional[str]:
     '''
     Gets a tag object and Extracts patterns
@@ -19,46 +74,130 @@ def find_price(tag : Tag) -> Optional[str]:
     string or none
     '''
     text = tag.get_text(strip=True)
-    match = re.search(r"\$(\d+[,.]?\d*)", text)
     
-    return match.group(0) if match else None
+    return _price_in_text(text)
 
-def _full_image_url(img: Tag) -> Optional[str]:
+def _element_price(el) -> Optional[str]:
+    '''
+    Extracts the price from the text of an lxml element
+    whose scripts and styles are already stripped.
+    Args:
+    el : lxml element
+    Returns:
+    string or none
+    '''
+    # Same text as get_text(strip=True)
+    text = ''.join(s.strip() for s in el.itertext())
+
+    return _price_in_text(text)
+
+def find_price_lxml(el) -> Optional[str]:
+    '''
+    Same as find_price, for an lxml element.
+    Args:
+    el : lxml element
+    Returns:
+    string or none
+    '''
+    # Like bs4's get_text, skip scripts and styles
+    etree.strip_elements(el, 'script', 'style', with_tail=False)
+
+    return _element_price(el)
+
+def _fast_text(tag : Tag) -> str:
+    '''
+    Same as tag.get_text(strip=True), but when the tag
+    holds a single string it is returned without walking
+    the subtree.
+    Args:
+    tag : bs4 Tag object
+    Returns:
+    the stripped text of the tag
+    '''
+    text = tag.string
+    # Comments and other special strings are skipped by get_text
+    if type(text) is NavigableString:
+        return text.strip()
+
+    return tag.get_text(strip=True)
+
+def _parse_page(html : str):
+    '''
+    Parses a whole product page with lxml.
+    Args:
+    html : the product page html
+    Returns:
+    lxml root element or None if the html could not be parsed.
+    '''
+    if not html:
+        return None
+
+    try:
+        tree = lxml.html.fromstring(html, parser=_LXML_PARSER)
+    except (etree.ParserError, ValueError) as e:
+        print(f"Error parsing HTML: {e}")
+        return None
+
+    # Like bs4's get_text, the text lookups skip scripts and styles
+    etree.strip_elements(tree, 'script', 'style', with_tail=False)
+
+    return tree
+
+def _find_page_price(tree) -> Optional[str]:
+    '''
+    Finds the first price inside a span, div or td of
+    the whole page. the containers are selected with
+    an xpath query so only they reach python.
+    Args:
+    tree : lxml root of the product page, see _parse_page
+    Returns:
+    string or none
+    '''
+    for container in _PRICE_CONTAINERS_XPATH(tree):
+        price = _element_price(container)
+        if price:
+            return price
+    
+    return None
+
+def _full_image_url(img) -> Optional[str]:
     '''
     Constructs a full image URL from an img tag.
     Args:
-    img : bs4 Tag object representing an image
+    img : bs4 Tag or lxml element representing an image
     Returns:
     Full URL as a string or None if the URL is invalid.
     '''
     img_src = img.get('src') or img.get('data-src')
 
-    if img_src and isinstance(img_src, str):
+    if not img_src or not isinstance(img_src, str):
+        return None
 
-        if not img_src:
-            return None
+    # Dispatch on the first two characters instead of
+    # trying every prefix with startswith.
+    head = img_src[:2]
+    if head == 'ht':
         if img_src.startswith(('http:', 'https:')):
             return img_src
-        if img_src.startswith('//'):
-            return f'https:{img_src}'
-        if img_src.startswith('/'):
-            return f'https://m.media-amazon.com{img_src}'
-        return None  # Unrecognized format
-    else:
-        return None
+    elif head == '//':
+        return f'https:{img_src}'
+    elif head[:1] == '/':
+        return f'https://m.media-amazon.com{img_src}'
+    return None  # Unrecognized format
 
-def _get_product_image(soup) -> Optional[str]:
+def _get_product_image(tree) -> Optional[str]:
     '''
     uses common selectors to find the product image
     Args:
-    soup : BeautifulSoup object of the product page
+    tree : lxml root of the product page, see _parse_page
     Returns:
     Full image URL as a string or None if not found.
     '''
     # Try the most common selectors one by one
-    for selector in ['#landingImage', '#imgBlkFront', '#main-image']:
-        img = soup.select_one(selector)
-        if img and img.get('src'):
+    for xpath in _IMAGE_XPATHS:
+        found = xpath(tree)
+        img = found[0] if found else None
+        if img is not None and img.get('src'):
             img_url = _full_image_url(img)
             if img_url:
                 return img_url
@@ -67,6 +206,72 @@ def _get_product_image(soup) -> Optional[str]:
     return None
 
 
+def _parse_fallback_html(
+        html : str,
+        missing_fields : Tuple[str, ...]
+        ) -> Optional[Dict[str, Optional[str]]]:
+    '''
+    Parses a product page and looks for the missing fields.
+    Runs in a worker process, so it takes and returns only
+    picklable values.
+    Args:
+    html : the product page html
+    missing_fields : the fields of the product dict that are None
+    Returns:
+    the fields to update in the product dict or None if
+    the html could not be parsed.
+    '''
+    # One lxml parse serves all the missing fields
+    tree = _parse_page(html)
+    if tree is None:
+        return None
+
+    fields : Dict[str, Optional[str]] = {}
+
+    if 'title' in missing_fields:
+        title_tag = next((found[0] for xpath in _TITLE_XPATHS if (found := xpath(tree))), None)
+        title_text = title_tag.text_content().strip() if title_tag is not None else None
+        
+        fields['title'] = title_text if title_text and len(title_text) >=5 else None
+    
+    if 'price' in missing_fields:
+        price = _find_page_price(tree)
+        if price:
+            fields['price'] = price
+    
+    if 'image' in missing_fields:
+        img_src = _get_product_image(tree)
+        fields['image'] = img_src if img_src else None
+
+    return fields
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    '''
+    Returns the process pool for the fallback parsing,
+    creating it on first use.
+    '''
+    global _parse_pool
+    if _parse_pool is None:
+        # Spawned, not forked. a forked worker inherits the pipes
+        # of playwright's driver and close_browser never returns.
+        _parse_pool = ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _parse_pool
+
+def close_parse_pool():
+    '''
+    Shuts down the fallback parsing pool.
+    Should be called once when the program is done.
+    '''
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown()
+        _parse_pool = None
+
+
+@lru_cache(maxsize=4096)
 def _standard_product_page(link: str) -> str:
     """
     Converts any Amazon link to a working product page URL
@@ -78,20 +283,8 @@ def _standard_product_page(link: str) -> str:
     If the link is already a valid product page, it returns it unchanged.
     """
     # Extract ASIN first
-    asin = None
-    patterns = [
-        r'/dp/([A-Z0-9]{10})',          # /dp/ASIN
-        r'/gp/product/([A-Z0-9]{10})',  # /gp/product/ASIN
-        r'/product/([A-Z0-9]{10})',     # /product/ASIN
-        r'ASIN=([A-Z0-9]{10})',         # ?ASIN=...
-        r'([A-Z0-9]{10})'               # Just ASIN
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, link)
-        if match:
-            asin = match.group(1)
-            break
+    match = _ASIN_RE.search(link) or _BARE_ASIN_RE.search(link)
+    asin = match.group(1) if match else None
     
     if not asin:
         return link  # Fallback to original if no ASIN found
@@ -100,6 +293,7 @@ def _standard_product_page(link: str) -> str:
     return f"https://www.amazon.com/dp/{asin}/?tag=generic&language=en_US"
 
 
+@lru_cache(maxsize=4096)
 def _get_asin(std_link: str) -> Optional[str]:
     """
     Extracts the ASIN from a standard Amazon link
@@ -112,7 +306,7 @@ def _get_asin(std_link: str) -> Optional[str]:
 
     return asin if len(asin) == 10 else None
 
-def extract_data_fallback(
+async def extract_data_fallback(
         data: Dict[str, Union[Optional[str], bool, List[Dict[str, Optional[str]]]]],
         product_page: bool | str | None):
     '''
@@ -127,46 +321,32 @@ def extract_data_fallback(
     Returns :
     product dict with all the required data
     '''
-    time.sleep(random.uniform(3, 8))
+    await asyncio.sleep(random.uniform(3, 8))
 
     if not product_page:
         return data
     
     if isinstance(product_page, str):
-        html = fp.get_playwright_html(product_page)
+        # Product pages have no result grid to wait for
+        html = await fp.get_playwright_html(product_page, min_results=0)
     else:
         return data
     
-    try:
-        soup = BeautifulSoup(html, features="html.parser")
-    except Exception as e:
-        print(f"Error parsing HTML: {e}")
+    if not html:
         return data
     
-    missing_fields = [k for k, v in data.items() if v is None and k != '_needs_fallback']
+    missing_fields = tuple(k for k, v in data.items() if v is None and k != '_needs_fallback')
 
-    if 'title' in missing_fields:
-        title_tag = soup.select_one('#productTitle') or soup.select_one('#title') or soup.select_one('h1.a-size-large')
-        title_text = title_tag.get_text().strip() if title_tag else None
-        
-        data['title'] = title_text if title_text and len(title_text) >=5 else None
-    
-    if 'price' in missing_fields:
-        price_container = soup.find_all(lambda tag : (
-            tag.name in ['span', 'div', 'td'] and
-            '$' in tag.get_text()
-        ))
-
-        for container in price_container:
-            if isinstance(container, Tag):
-                price = find_price(container)
-                if price:
-                    data['price'] = price
-                    break
-    
-    if 'image' in missing_fields:
-        img_src = _get_product_image(soup)
-        data['image'] = img_src if img_src else None
+    # Parse in the process pool, the event loop is free
+    # to keep the other fallback pages loading meanwhile.
+    loop = asyncio.get_running_loop()
+    found = await loop.run_in_executor(
+        _get_parse_pool(), _parse_fallback_html, html, missing_fields
+    )
+    if found is None:
+        return data
+
+    data.update(found)
     
     CRITICAL_KEYS = ['title', 'price', 'link', 'image']
     # If one of the items is None, we need a fallback
@@ -194,11 +374,6 @@ def extract_data(
         'image': None,
         '_needs_fallback': False
     }
-    # Title - look for heading elements or spans with title-like classes
-    title = tag.find('h2') or tag.find('span')
-    if title:
-        data['title'] = title.get_text(strip=True)
-
     # Link - find product links
     link = tag.find('a', href=True)
     if link and isinstance(link, Tag) and '/dp/' in link['href']:  # Amazon product links contain /dp/
@@ -217,6 +392,16 @@ def extract_data(
                 if asin:
                     data['asin'] = asin
 
+    # Without a product link the tag is dropped anyway,
+    # skip the title, image and price lookups for it.
+    if not (data['asin'] and data['link']):
+        return {}
+
+    # Title - look for heading elements or spans with title-like classes
+    title = tag.find('h2') or tag.find('span')
+    if title:
+        data['title'] = _fast_text(title)
+
     # Image - find product images
     img_element = tag.find('img', src=True)
     if img_element and isinstance(img_element, Tag):
@@ -233,4 +418,4 @@ def extract_data(
     required_fields = ['asin', 'title', 'price', 'link', 'image']
     data['_needs_fallback'] = any(data.get(key) is None for key in required_fields)
     
-    return data if data['asin'] and data['link'] else {}
\ No newline at end of file
+    return data
\ No newline at end of file
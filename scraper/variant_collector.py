@@ -1,46 +1,147 @@
-from typing import List, Dict
-from playwright.sync_api import Page, Locator
-from playwright.sync_api import sync_playwright
+from typing import List, Dict, Tuple, Optional
+from playwright.async_api import Page, Locator, Response
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+import re
 import random
-from typing import Optional, List
+import asyncio
 from itertools import product
-from bs4 import BeautifulSoup, Tag
+from functools import lru_cache
+import lxml.html
 
 import scraper.fetch_page as fp
 import scraper.parse as parse
 
-def locator_to_tag(locator):
-    """Convert a Playwright locator to a BeautifulSoup Tag object."""
-    # Get the HTML content of the element
-    html = locator.inner_html()
-    
-    # Parse with BeautifulSoup and get the first element
-    soup = BeautifulSoup(html, 'html.parser')
-    tag = soup.find()  # the first tag in the HTML
+class FetchError(Exception):
+    '''
+    Raised when the product page could not be loaded or
+    processed. unlike an empty result, retrying may help.
+    '''
 
-    if not isinstance(tag, Tag):
-        raise ValueError("No valid Tag element found in the locator's HTML")
-    
-    return tag
+def html_to_element(html : str):
+    """Parse an html fragment and return its first lxml element."""
+    # The fragments may start with a plain string or a comment
+    for el in lxml.html.fragments_fromstring(html):
+        if isinstance(getattr(el, 'tag', None), str):
+            return el
 
-def _get_price(option : Locator) -> Optional[str]:
+    raise ValueError("No valid element found in the locator's HTML")
+
+@lru_cache(maxsize=512)
+def _price_from_html(html : str) -> Optional[str]:
+    """
+    Finds the price in the html of an option. the same option
+    html comes back for many possibilities, so the parse is cached.
+    """
+    return parse.find_price_lxml(html_to_element(html))
+
+async def _get_price(option : Locator) -> Optional[str]:
     """
     Extracts the price from a variant option element.
     Args:
         option: Playwright Locator of the variant option (li).
     Returns:
         Optional[str]: Price if found, otherwise None.
-    This function uses the locator_to_tag function to convert the Playwright Locator
-    to a BeautifulSoup Tag, and then uses the parse module to find the price.
+    The option html is parsed with lxml and searched by the parse
+    module, see _price_from_html.
     """
-    option_tag = locator_to_tag(option)
-    price = parse.find_price(option_tag)
+    price = _price_from_html(await option.inner_html())
     if price:
         return price
     
     return None
 
-def _get_sibling_options(
+# The label of a variant section, e.g "Color:"
+_LABEL_XPATH = '//*[contains(text(), "{}:")]'
+# Built once for the common variant types, other types
+# are formatted on demand.
+_VARIANT_XPATHS = {
+    vt : _LABEL_XPATH.format(vt) for vt in ("Color", "Size", "Style")
+}
+# The options list is the next sibling of one of the
+# label's ancestors, tried from the closest one.
+_SIBLING_LEVELS = (3, 4, 5)
+_SIBLING_XPATHS = tuple(
+    f'xpath=./ancestor::div[{level}]/following-sibling::*[1]'
+    for level in _SIBLING_LEVELS
+)
+# Does the whole options lookup of _get_sibling_options inside
+# the page, in one round trip. returns -1 when the section ids
+# have visible options, the index of the first label level in
+# _SIBLING_XPATHS that has them, -2 when there are labels but
+# no options next to them, or null when there is no label.
+_FIND_OPTIONS_JS = """
+([sectionsSelector, labelXPath, levels]) => {
+    // Same rule as playwright's :visible
+    const visible = el => {
+        const rect = el.getBoundingClientRect();
+        return rect.width > 0 && rect.height > 0
+            && getComputedStyle(el).visibility !== 'hidden';
+    };
+    const hasOptions = root => !!root
+        && [...root.querySelectorAll('li[data-asin]')].some(visible);
+
+    // A bad selector must not stop the label search below
+    try {
+        if (sectionsSelector
+                && [...document.querySelectorAll(sectionsSelector)].some(visible)) {
+            return -1;
+        }
+    } catch (e) {}
+
+    const found = document.evaluate(
+        labelXPath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+    );
+    const labels = [];
+    for (let i = 0; i < found.snapshotLength; i++) {
+        labels.push(found.snapshotItem(i));
+    }
+
+    for (let i = 0; i < levels.length; i++) {
+        if (labels.some(label => {
+            // ancestor::div[level], counted from the closest div
+            let el = label.parentElement, n = 0;
+            while (el && !(el.tagName === 'DIV' && ++n === levels[i])) {
+                el = el.parentElement;
+            }
+            return hasOptions(el && el.nextElementSibling);
+        })) {
+            return i;
+        }
+    }
+    return labels.length ? -2 : null;
+}
+"""
+
+# Amazon's ids for the variant sections, e.g #variation_color_name.
+# the browser finds them by id instead of scanning every text node.
+_SECTION_SELECTORS = ('#variation_{}_name', '#inline-twister-row-{}_name')
+# Slugs that are safe inside a css id selector as they are
+_SLUG_RE = re.compile(r'[a-z0-9_-]+')
+
+def _section_options_selector(
+        variant_type : str,
+        visible : bool = True
+    ) -> Optional[str]:
+    '''
+    Builds the css selector of the options inside the
+    known variant sections of the given type.
+    visible=False leaves out playwright's :visible, for
+    selectors that run in the page itself.
+    Returns None when the type has characters an id selector
+    cant take as is (e.g "Men's Size", "Size (US)"), those
+    types are only found by their label.
+    '''
+    slug = variant_type.strip().lower().replace(' ', '_')
+    if not _SLUG_RE.fullmatch(slug):
+        return None
+
+    suffix = ':visible' if visible else ''
+    return ', '.join(
+        f'{section.format(slug)} li[data-asin]{suffix}'
+        for section in _SECTION_SELECTORS
+    )
+
+async def _get_sibling_options(
         page : Page,
         variant_type : str
     ) -> Optional[Locator]:
@@ -55,130 +156,285 @@ def _get_sibling_options(
         Locator object representing the variant options, or None.
     """
     try:
-        label_container = page.locator(f'//*[contains(text(), "{variant_type}:")]')
-        if not label_container.count():
+        label_xpath = _VARIANT_XPATHS.get(variant_type) or _LABEL_XPATH.format(variant_type)
+
+        # Amazon's section ids first, then the label text and
+        # its ancestor levels. the page tries them all at once
+        # instead of one count() round trip per try.
+        found = await page.evaluate(_FIND_OPTIONS_JS, [
+            _section_options_selector(variant_type, visible=False),
+            label_xpath,
+            list(_SIBLING_LEVELS)
+        ])
+
+        if found is None:
+            return None
+
+        if found == -2:
+            print('could not find any valid varaint options for ', variant_type)
             return None
-        
-        for level in [3, 4, 5]:
-            sibling = label_container.locator(f'xpath=./ancestor::div[{level}]/following-sibling::*[1]')
-            if not sibling.count():
-                continue
-            sibling_options = sibling.locator('li[data-asin]:visible')
 
-            options_count = sibling_options.count()
-            if options_count > 0:
-                return sibling_options
+        # Only returned when the type has a section selector
+        section_options = _section_options_selector(variant_type)
+        if found == -1 and section_options:
+            return page.locator(section_options)
 
-        print('could not find any valid varaint options for ', variant_type)
-        
-        return None
+        sibling = page.locator(label_xpath).locator(_SIBLING_XPATHS[found])
+        return sibling.locator('li[data-asin]:visible')
     
     except Exception as e:
         print(f'Error fetching variant options: {e}')
         return None
 
-# Value getters
-def _get_color_value(section: Locator) -> Optional[str]:
+# Amazon loads the data of a selected variant with an ajax
+# call, these url fragments identify it.
+_VARIANT_RESPONSE_HINTS = ('ajax', 'twister', 'getPriceBadge')
+
+def _is_variant_response(response : Response) -> bool:
+    url = response.url
+    return any(hint in url for hint in _VARIANT_RESPONSE_HINTS)
+
+async def _click_and_wait(
+        page : Page,
+        option : Locator,
+        timeout : int = 2000
+    ):
     """
-    Extracts color value from the Color section of an amazon
-    product page by checking for an image with alt or title attributes.
+    Clicks a variant option and waits until the page has
+    loaded the variant, instead of sleeping a fixed time.
     Args:
-        section: Playwright Locator of the color option (li).
-    Returns:
-        Optional[str]: Color value if found, otherwise None.
+        page: Playwright page object.
+        option: Playwright Locator of the option (li) to click.
+        timeout: Max ms to wait for the variant's ajax call.
     """
-    img = section.locator('img')
-    if img.count() > 0:
-        return img.first.get_attribute('alt') or img.first.get_attribute('title')
-    return None
+    # Listen before clicking, so a fast response isnt missed
+    response = asyncio.ensure_future(page.wait_for_event(
+        "response", predicate=_is_variant_response, timeout=timeout
+    ))
+
+    # Click errors are the caller's business, only the
+    # response wait below is allowed to time out.
+    # click() scrolls the option into view itself when
+    # it is outside the viewport, even with force=True.
+    try:
+        await option.click(force=True)
+    except BaseException:
+        response.cancel()
+        raise
 
-def _get_option_value(section: Locator) -> Optional[str]:
+    try:
+        await response
+    except PlaywrightTimeoutError:
+        # No ajax call, the page updated without the network.
+        # an already idle page returns right away.
+        try:
+            await page.wait_for_load_state('networkidle', timeout=1500)
+        except PlaywrightTimeoutError:
+            pass
+
+# Runs inside the page on every matched option. color options
+# carry their value in the img alt/title, the rest in their text.
+_OPTION_VALUES_JS = """
+els => els.map(li => {
+    const img = li.querySelector('img');
+    return {
+        color: img ? (img.getAttribute('alt') || img.getAttribute('title')) : null,
+        text: li.innerText.trim()
+    };
+})
+"""
+
+async def _get_options_values(
+        options : Locator,
+        variant_type : str
+    ) -> List[Optional[str]]:
     """
-    Except for the Color options values which require parsing
-    img tags, all the other options values can be extracted
-    using this function.
+    Reads the values of all the options with a single
+    evaluate call, the img alt/title for Color and the
+    inner text for every other type.
     Args:
-        section: Playwright Locator of the option (li).
+        options: Playwright Locator of the variant options (li).
+        variant_type: The type of the options, e.g "Color".
     Returns:
-        Optional[str]: Option value if found, otherwise None.
+        List of option values in the same order as the options.
     """
     try:
-        return section.inner_text().strip()
-    except:
-        return None
+        values = await options.evaluate_all(_OPTION_VALUES_JS)
+    except Exception as e:
+        print(f'Error reading option values: {e}')
+        return []
+
+    field = 'color' if variant_type.lower() == 'color' else 'text'
+    return [v[field] or None for v in values]
 
-def _get_variant_types(page: Page) -> List[str]:
+async def _get_variant_types(page: Page) -> List[str]:
     """
     Extracts variant types like 'Size', 'Style', etc., by looking for label spans
     and checking if nearby li[data-asin] elements exist.
     """
     try:
         labels = page.locator('div[class]:has-text("feature") span:has-text(":")')
-        variant_types = set()
 
-        for label_el in labels.all():
-            #label_el = labels.nth(i)
-            label_text = label_el.inner_text().strip()
+        # The text of every label in one round trip
+        label_texts = await labels.evaluate_all('els => els.map(el => el.innerText.trim())')
 
+        # Candidate names in page order, each one is probed once
+        candidates : Dict[str, None] = {}
+        for label_text in label_texts:
             if ":" not in label_text:
                 continue
 
             variant = label_text.split(":")[0].strip()
             if not variant or variant.count(' ') >= 2:
                 continue
-            
-            # Check if there's a nearby UL/LI with data-asin
-            li_locator = _get_sibling_options(page=page, variant_type=variant)
-            if li_locator and li_locator.count() > 0:
-                variant_types.add(variant)
+            candidates[variant] = None
 
+        variant_types : List[str] = []
+        for variant in candidates:
+            # Check if there's a nearby UL/LI with data-asin,
+            # a returned locator always has options.
+            if await _get_sibling_options(page=page, variant_type=variant):
+                variant_types.append(variant)
 
-        return list(dict.fromkeys(variant_types))
+        return variant_types
     except Exception as e:
         print(f"Error extracting filtered variant types: {e}")
         return []
 
 
-def _get_all_combinitions(page : Page) -> Dict[str, List[str | None]]:
+# True if any of the options shows a price
+_HAS_PRICE_JS = r"els => els.some(li => /\$\d/.test(li.innerText))"
+
+# Index of the selected option, or -1. old layouts mark it
+# with the swatchSelect class, newer ones with aria attributes.
+_SELECTED_INDEX_JS = """
+els => els.findIndex(li =>
+    li.classList.contains('swatchSelect')
+    || li.getAttribute('aria-checked') === 'true'
+    || !!li.querySelector('[aria-checked="true"], [aria-selected="true"]')
+)
+"""
+
+async def _get_priced_types(
+        snapshot : Dict[str, Tuple[Locator, List[Optional[str]]]]
+    ) -> List[str]:
+    '''
+    Finds the variant types whose options show their price.
+    Args:
+        snapshot: see _snapshot_variants
+    Returns:
+        The priced variant types, in page order.
+    '''
+    priced = []
+    for key, (options, _) in snapshot.items():
+        try:
+            if await options.evaluate_all(_HAS_PRICE_JS):
+                priced.append(key)
+        except Exception as e:
+            print(f'Error checking prices of {key}: {e}')
+    return priced
+
+async def _extract_leaf_axis(
+        page : Page,
+        snapshot : Dict[str, Tuple[Locator, List[Optional[str]]]],
+        leaf_key : str
+    ) -> List[Dict[str, Optional[str]]]:
     '''
-    Gets all variant possibilities for the product.
+    When only one variant type shows prices, the price is a
+    function of that type alone. so only its options are
+    clicked, once each, and the other types are read from
+    what the page has selected after the click.
+    Also used for pages with a single variant type.
+    Args:
+        page: Playwright page object.
+        snapshot: see _snapshot_variants
+        leaf_key: The variant type whose options show prices.
+    Returns:
+        One variant per option of the leaf type, same shape
+        as extract_data's result.
+    '''
+    options, values = snapshot[leaf_key]
+    all_variants_list = []
+    seen = set()
+
+    for i, val in enumerate(values):
+        # Same value twice, the first option wins like in extract_data
+        if not val or val.lower() in seen:
+            continue
+        seen.add(val.lower())
+
+        option = options.nth(i)
+        try:
+            await _click_and_wait(page, option)
+        except Exception as e:
+            print(f'click failed for {leaf_key} : {val}\n {e}')
+            continue
+
+        # Keep the page order of the types in the output
+        this_variant_options : Dict[str, Optional[str]] = {}
+        for key, (other_options, other_values) in snapshot.items():
+            if key == leaf_key:
+                this_variant_options[key] = val
+                continue
+            try:
+                selected = await other_options.evaluate_all(_SELECTED_INDEX_JS)
+            except Exception as e:
+                print(f'Error reading the selected {key}: {e}')
+                this_variant_options[key] = None
+                continue
+            this_variant_options[key] = other_values[selected] if 0 <= selected < len(other_values) else None
+
+        try:
+            this_variant_options['price'] = await _get_price(option)
+        except Exception as e:
+            print(f'Error reading the price of {leaf_key} : {val}\n {e}')
+            this_variant_options['price'] = None
+        all_variants_list.append(this_variant_options)
+
+    if not any(v['price'] for v in all_variants_list):
+        print(f'{len(all_variants_list)} variants had no price, returning...')
+        print()
+        return []
+
+    return all_variants_list
+
+async def _snapshot_variants(
+        page : Page
+    ) -> Dict[str, Tuple[Locator, List[Optional[str]]]]:
+    '''
+    Gets all variant possibilities for the product, together
+    with the locator of their options. each variant type is
+    looked up once and all its values are read in one batch,
+    so the rest of the extraction works from this snapshot.
     e.g:
     {
-        "Color" : ['red', 'black', 'white'],
-        "Style" : ['wired', 'wireless],
-        "Pattern" : ['headset', 'headset + keyboard']
+        "Color" : (<options locator>, ['red', 'black', 'white']),
+        "Style" : (<options locator>, ['wired', 'wireless]),
+        "Pattern" : (<options locator>, ['headset', 'headset + keyboard'])
     }
     Returns:
-        Dict[str, List[str | None]]: Dictionary with variant types as keys and lists of options as values.
+        Dictionary with variant types as keys and (options locator,
+        option values) as values. the values are in option order.
     '''
     try:
-        keys = _get_variant_types(page=page)
+        keys = await _get_variant_types(page=page)
         if not keys:
             return {}
         
-        combinitions : Dict[str, List[str | None]] = {k : [] for k in keys}
+        snapshot : Dict[str, Tuple[Locator, List[Optional[str]]]] = {}
         
         for key in keys:
-            options = _get_sibling_options(page=page, variant_type=key)
+            options = await _get_sibling_options(page=page, variant_type=key)
             if not options:
                 continue
             
-            opt_count = options.count()
-            if opt_count == 0:
-                continue
-            
-            for i in range(opt_count):
-                option = options.nth(i)
-                if key == 'Color':
-                    combinitions['Color'].append(_get_color_value(option))
-                else:
-                    combinitions[key].append(_get_option_value(option))
-        return combinitions
+            snapshot[key] = (options, await _get_options_values(options, variant_type=key))
+        return snapshot
     except Exception as e:
         print(f'failed getting possibilities:\n{e}')
         return {}
 
-def extract_data(
+async def extract_data(
         page : Page
         ) -> List[Dict[str, Optional[str]]]:
     """Extract product data from an Amazon product page.
@@ -204,12 +460,31 @@ def extract_data(
     5. end
     '''
 
-    combinitions = _get_all_combinitions(page)
-    if not combinitions:
+    snapshot = await _snapshot_variants(page)
+    if not snapshot:
         return []
+
+    # A single type needs none of the possibility
+    # bookkeeping below, its options are the variants.
+    if len(snapshot) == 1:
+        return await _extract_leaf_axis(page, snapshot, next(iter(snapshot)))
+
+    # Usually only one type shows prices on its options.
+    # then there is no need to click through the product of
+    # all the types, its options alone decide the price.
+    priced_types = await _get_priced_types(snapshot)
+    if len(priced_types) == 1:
+        return await _extract_leaf_axis(page, snapshot, priced_types[0])
+
+    combinitions : Dict[str, List[Optional[str]]] = {
+        key : values for key, (_, values) in snapshot.items()
+    }
     
-    combinitions_list = list(combinitions.values())
-    keys_list = list(combinitions.keys())
+    # product() changes the last type fastest. putting the
+    # types with the fewest options first means the types
+    # that change least often are also the ones clicked least.
+    keys_list = sorted(combinitions, key=lambda k: len(combinitions[k]))
+    combinitions_list = [combinitions[k] for k in keys_list]
     
     possibilities = product(*combinitions_list)
     
@@ -230,6 +505,18 @@ def extract_data(
         variant_types_list.append(possib_list)
 
     variant_types_count = len(variant_types_list)
+
+    # The options of a variant type are the same for every
+    # possibility, index the snapshot by value once, so
+    # selecting a value is a dict lookup.
+    value_index : Dict[str, Dict[str, Locator]] = {}
+    for key, (options, values) in snapshot.items():
+        index : Dict[str, Locator] = {}
+        for i, option_value in enumerate(values):
+            if option_value:
+                # Like the old linear search, the first match wins
+                index.setdefault(option_value.lower(), options.nth(i))
+        value_index[key] = index
     
     # Now we go through the options inside
     # the each sublist and selelct the each
@@ -237,48 +524,35 @@ def extract_data(
     # we get the price.
     all_variants_list = []
     no_price = 0
+    # What the page has selected right now, per variant type
+    current_selection : Dict[str, str] = {}
 
     for variant_sublist in variant_types_list:
-        this_variant_options = {}
+        # Keep the page order of the types in the output
+        this_variant_options = dict.fromkeys(combinitions)
         get_price_from = {}
+        # A click may reset the types after it, so once
+        # something was clicked the rest is clicked too.
+        clicked = False
         for variant_option in variant_sublist:
             (key, val), = variant_option.items()
             this_variant_options[key] = val
-            options : Locator | None = _get_sibling_options(page=page, variant_type=key)
-            if options:
-                for option in options.all():
-                    if key.lower() == 'color':
-                        color_value = _get_color_value(option)
-                        if color_value:
-                            if color_value.lower() == val.lower():
-                                try:
-                                    option.scroll_into_view_if_needed()
-                                    option.click(force=True)
-                                    page.wait_for_timeout(500)
-
-                                    if key not in get_price_from.keys():
-                                        get_price_from[key] = option
-                                    
-                                    break
-                                except Exception as e:
-                                    print(f'click failed for {key} : {val}\n {e}')
-                                    break
-                    else:
-                        option_value = _get_option_value(option)
-                        if option_value:
-                            if option_value.lower() == val.lower():
-                                try:
-                                    option.scroll_into_view_if_needed()
-                                    option.click(force=True)
-                                    page.wait_for_timeout(500)
-
-                                    if key not in get_price_from.keys():
-                                        get_price_from[key] = option
-                                    
-                                    break
-                                except Exception as e:
-                                    print(f'click failed for {key} : {val}\n {e}')
-                                    break
+            if key in value_index:
+                option = value_index[key].get(val.lower()) if val else None
+                if option and not clicked and current_selection.get(key) == val:
+                    # Already selected by the previous possibility
+                    get_price_from[key] = option
+                elif option:
+                    try:
+                        await _click_and_wait(page, option)
+                        clicked = True
+                        current_selection[key] = val
+
+                        if key not in get_price_from.keys():
+                            get_price_from[key] = option
+                    except Exception as e:
+                        print(f'click failed for {key} : {val}\n {e}')
+                        current_selection.pop(key, None)
             else:
                 print('no options found for ', key)
             
@@ -288,8 +562,10 @@ def extract_data(
         # we need to check he option for all typs. e.g:
         # Size, Color, Style, etc ...
         price = None
-        for key, option in get_price_from.items():
-            price = _get_price(option)
+        for key in combinitions:
+            if key not in get_price_from:
+                continue
+            price = await _get_price(get_price_from[key])
             if price:
                 break
         
@@ -308,86 +584,71 @@ def extract_data(
 
 
     
-def get_variants(
+async def get_variants(
         product_page : str,
         callback,
         headless: bool = True
         ) -> List[Dict[str, Optional[str]]]:
     """
     Get product variants using Playwright and process with callback.
+    The browser is shared between concurrent calls and the contexts
+    are borrowed from a pool, so each call only opens its own page.
     
     Args:
         product_page: URL of the product page
-        callback: Function that takes a Playwright Page and returns parsed variants
-        headless: Run browser in headless mode
+        callback: Coroutine that takes a Playwright Page and returns parsed variants
+        headless: Run browser in headless mode, see fp.get_browser. only
+        used when the browser is launched.
     
     Returns:
-        Parsed variants from callback or None if failed
+        Parsed variants from callback. an empty list means the
+        page loaded fine but has no variants, or the callback failed.
+    
+    Raises:
+        FetchError: If playwright failed to load the page.
     """
     
-    with sync_playwright() as p:
-        browser = None
-        page = None
-        context = None
+    page = None
+    context = None
+    broken = False
+    try:
         try:
-            browser = p.chromium.launch(
-                headless=headless,
-                args=[
-                    '--disable-blink-features=AutomationControlled',
-                    '--disable-infobars',
-                    '--ignore-certificate-errors',
-                    '--no-sandbox',
-                    f'--user-agent={random.choice(fp.USER_AGENTS)}'
-                ],
-                slow_mo=random.randint(0, 100)  # Humanize the speed
-            )
-            context = browser.new_context(
-                user_agent=random.choice(fp.USER_AGENTS),
-                viewport={"width": 1280, "height": 800},
-                locale="en-US",
-                bypass_csp=True  
-            )
-            page = context.new_page()
+            # Like fp.get_browser, only matters before the launch
+            context = await fp.acquire_context(headless)
+            page = await context.new_page()
 
             # Randomize initial interactions
             if random.random() > 0.5:
-                page.mouse.move(
+                await page.mouse.move(
                     random.randint(0, 500),
                     random.randint(0, 500)
                 )
 
-            # Clear Playwright's automation flags
-            page.add_init_script("""
-                delete navigator.__proto__.webdriver;
-                Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
-            """)
-
             print(f"Getting variants for: {product_page}\n")
-            page.goto(product_page, timeout=60000, wait_until='domcontentloaded')  # 60s timeout
-
-            return callback(page)
+            await page.goto(product_page, timeout=60000, wait_until='domcontentloaded')  # 60s timeout
+        except Exception as e:
+            # The retry gets a fresh context
+            broken = True
+            raise FetchError(f'Error getting variants for {product_page}: {e}') from e
 
+        # The page loaded, a parsing error is not worth a retry
+        try:
+            return await callback(page)
         except Exception as e:
-            print(f'Error getting variants. exception:\n{e}')
+            print(f'Error parsing variants for {product_page}: {e}')
             return []
 
-        finally:
-        # Close resources in reverse creation order
-        # Prevents "already closed" errors
-            try:
-                if page:
-                    page.close()
-            except Exception as e:
-                print(f"Error closing page: {e}")
-
-            try:
-                if context:
-                    context.close()
-            except Exception as e:
-                print(f"Error closing context: {e}")
+    finally:
+    # Close resources in reverse creation order
+    # Prevents "already closed" errors.
+    # The shared browser stays open and the
+    # context goes back to the pool.
+        try:
+            if page:
+                await page.close()
+        except Exception as e:
+            print(f"Error closing page: {e}")
+            broken = True
 
-            try:
-                if browser:
-                    browser.close()
-            except Exception as e:
-                print(f"Error closing browser: {e}")
\ No newline at end of file
+        if context:
+            await fp.release_context(context, broken=broken)